@@ -4,16 +4,18 @@ import glob
 import os
 from os.path import join, getmtime, exists
 
-from .generator import PariFunctionGenerator
+from .generator import PariFunctionGenerator, gen_filename, decl_filename
 from .paths import pari_share
 
 
+# Note: the autogen package is deliberately kept as plain Python: it is
+# imported by setup.py and run before Cython is invoked (it generates
+# the sources which are then cythonized), and the check below relies on
+# the modification times of autogen/*.py.
 def rebuild(force=False):
-    pari_module_path = 'cypari2'
     src_files = [join(pari_share(), 'pari.desc')] + \
                  glob.glob(join('autogen', '*.py'))
-    gen_files = [join(pari_module_path, 'auto_paridecl.pxd'),
-                 join(pari_module_path, 'auto_gen.pxi')]
+    gen_files = [decl_filename, gen_filename]
 
     if not force and all(exists(f) for f in gen_files):
         src_mtime = max(getmtime(f) for f in src_files)
@@ -23,4 +25,4 @@ def rebuild(force=False):
             return
 
     G = PariFunctionGenerator()
-    G()
+    G(use_cache=not force)
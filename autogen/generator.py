@@ -15,10 +15,17 @@ Auto-generate methods for PARI functions.
 
 from __future__ import absolute_import, print_function, unicode_literals
 import os, re, sys, io
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from glob import glob
+from operator import itemgetter
 
 from .args import PariArgumentGEN, PariInstanceArgument
-from .parser import read_pari_desc, parse_prototype
+from .parser import read_pari_desc, parse_prototype, supported_prototype
 from .doc import get_rest_doc
+from .paths import pari_share
 
 
 autogen_top = "# This file is auto-generated by {}\n".format(
@@ -56,9 +63,14 @@ from .types cimport *
 cdef extern from *:
 '''
 
+gen_filename = os.path.join('cypari2', 'auto_gen.pxi')
+instance_filename = os.path.join('cypari2', 'auto_instance.pxi')
+decl_filename = os.path.join('cypari2', 'auto_paridecl.pxd')
+cache_dirname = os.path.join('.cache', 'autogen')
+
 
 function_re = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
-function_blacklist = {"O",  # O(p^e) needs special parser support
+function_blacklist = frozenset({"O",  # O(p^e) needs special parser support
         "alias",            # Not needed and difficult documentation
         "listcreate",       # "redundant and obsolete" according to PARI
         "print",            # Conflicts with Python builtin
@@ -68,7 +80,43 @@ function_blacklist = {"O",  # O(p^e) needs special parser support
         "uninline",         # idem
         "local",            # idem
         "my",               # idem
-        }
+        })
+
+
+def source_hash():
+    """
+    Return a hash of the inputs of the code generation: the file
+    ``pari.desc`` and the sources of the ``autogen`` package.
+
+    EXAMPLES::
+
+        >>> from autogen.generator import source_hash
+        >>> len(source_hash())
+        128
+    """
+    h = hashlib.blake2b()
+    autogen_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = ([os.path.join(pari_share(), 'pari.desc')] +
+               sorted(glob(os.path.join(autogen_dir, '*.py'))))
+    for filename in sources:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def write_tmp_file(filename, buf):
+    """
+    Write the contents of the ``io.StringIO`` buffer ``buf`` to
+    ``filename + '.tmp'`` and close the buffer.
+    """
+    with io.open(filename + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(buf.getvalue())
+    buf.close()
+
+
+# Cache for PariFunctionGenerator.write_declaration(): maps a tuple of
+# argument classes to the corresponding C types joined by commas
+_ctypes_cache = {}
 
 
 class PariFunctionGenerator(object):
@@ -80,9 +128,10 @@ class PariFunctionGenerator(object):
     :class:`Pari`.
     """
     def __init__(self):
-        self.gen_filename = os.path.join('cypari2', 'auto_gen.pxi')
-        self.instance_filename = os.path.join('cypari2', 'auto_instance.pxi')
-        self.decl_filename = os.path.join('cypari2', 'auto_paridecl.pxd')
+        self.gen_filename = gen_filename
+        self.instance_filename = instance_filename
+        self.decl_filename = decl_filename
+        self.cache_dirname = cache_dirname
 
     def can_handle_function(self, function, cname="", **kwds):
         """
@@ -99,22 +148,22 @@ class PariFunctionGenerator(object):
             >>> G.can_handle_function("bnfinit", "bnfinit0", **{"class":"hard"})
             False
         """
+        # Checks are ordered such that the most common reasons for
+        # rejecting a function come first.
         if not cname:
             # No corresponding C function => must be specific to GP or GP2C
             return False
+        if kwds.get("class", "unknown") != "basic":
+            # Different class: probably something technical or
+            # specific to gp or gp2c
+            return False
         if function in function_blacklist:
             # Blacklist specific troublesome functions
             return False
         if not function_re.match(function):
             # Not a legal function name, like "!_"
             return False
-        cls = kwds.get("class", "unknown")
-        sec = kwds.get("section", "unknown")
-        if cls != "basic":
-            # Different class: probably something technical or
-            # specific to gp or gp2c
-            return False
-        if sec == "programming/control":
+        if kwds.get("section", "unknown") == "programming/control":
             # Skip if, return, break, ...
             return False
         return True
@@ -226,12 +275,15 @@ class PariFunctionGenerator(object):
                     return new_gen(_ret)
             <BLANKLINE>
         """
+        if not supported_prototype(prototype):
+            return  # Skip unsupported prototype codes
         try:
             args, ret = parse_prototype(prototype, help)
         except NotImplementedError:
-            return  # Skip unsupported prototype codes
+            return  # Skip other unsupported prototypes
 
         doc = get_rest_doc(function)
+        doc = doc.replace("\n", "\n        ")  # Indent doc
 
         self.write_declaration(cname, args, ret, self.decl_file)
 
@@ -247,6 +299,52 @@ class PariFunctionGenerator(object):
         self.write_method(function, cname, args, ret, args[1:],
                 self.instance_file, doc, obsolete)
 
+    def generate_code(self, kwds):
+        """
+        Generate the code for one PARI function in memory.
+
+        INPUT:
+
+        - ``kwds`` -- dictionary describing the PARI function, as
+          in the output of ``read_pari_desc``
+
+        OUTPUT: ``None`` if :meth:`can_handle_function` rejects the
+        function. Otherwise, a tuple ``(gen, instance, decl)`` of
+        strings with the code written by :meth:`handle_pari_function`
+        for ``auto_gen.pxi``, ``auto_instance.pxi`` and
+        ``auto_paridecl.pxd``.
+
+        EXAMPLES::
+
+            >>> from autogen.generator import PariFunctionGenerator
+            >>> G = PariFunctionGenerator()
+            >>> G.generate_code({"function": "_bnfinit", "cname": "bnfinit0",
+            ...     "class": "basic"}) is None
+            True
+            >>> gen, instance, decl = G.generate_code({"function": "setrand",
+            ...     "cname": "setrand", "prototype": "vG",
+            ...     "help": "setrand(n): reset the seed...",
+            ...     "class": "basic", "section": "programming/specific"})
+            >>> print(decl)
+                void setrand(GEN)
+            <BLANKLINE>
+        """
+        if not self.can_handle_function(**kwds):
+            return None
+        G = copy(self)
+        G.gen_file = io.StringIO()
+        G.instance_file = io.StringIO()
+        G.decl_file = io.StringIO()
+        try:
+            G.handle_pari_function(**kwds)
+        except Exception as e:
+            # The code is generated in a worker thread: make sure that
+            # the error tells for which function
+            raise RuntimeError("failed to generate code for PARI function %r"
+                               % kwds["function"]) from e
+        return (G.gen_file.getvalue(), G.instance_file.getvalue(),
+                G.decl_file.getvalue())
+
     def write_declaration(self, cname, args, ret, file):
         """
         Write a .pxd declaration of a PARI library function.
@@ -260,9 +358,14 @@ class PariFunctionGenerator(object):
         - ``file`` -- a file object where the declaration should be
           written to
         """
-        args = ", ".join(a.ctype() for a in args)
-        s = '    {ret} {function}({args})'.format(ret=ret.ctype(), function=cname, args=args)
-        print(s, file=file)
+        # The C type only depends on the class of the argument and
+        # many PARI functions have the same argument types.
+        key = tuple(type(a) for a in args)
+        try:
+            ctypes = _ctypes_cache[key]
+        except KeyError:
+            ctypes = _ctypes_cache[key] = ", ".join(a.ctype() for a in args)
+        file.write(f"    {ret.ctype()} {cname}({ctypes})\n")
 
     def write_method(self, function, cname, args, ret, cargs, file, doc, obsolete):
         """
@@ -281,77 +384,179 @@ class PariFunctionGenerator(object):
 
         - ``file`` -- a file object where the code should be written to
 
-        - ``doc`` -- the docstring for the method
+        - ``doc`` -- the docstring for the method, with all lines
+          except the first one already indented
 
         - ``obsolete`` -- if ``True``, a deprecation warning will be
           given whenever this method is called
         """
-        doc = doc.replace("\n", "\n        ")  # Indent doc
-
         protoargs = ", ".join(a.prototype_code() for a in args)
         callargs = ", ".join(a.call_code() for a in cargs)
 
-        s = "    def {function}({protoargs}):\n"
+        parts = [f"    def {function}({protoargs}):\n"]
         if doc:
             # Use triple single quotes to make it easier to doctest
             # this within triply double quoted docstrings.
-            s += "        r'''\n        {doc}\n        '''\n"
+            parts.append(f"        r'''\n        {doc}\n        '''\n")
         # Warning for obsolete functions
         if obsolete:
-            s += "        from warnings import warn\n"
-            s += "        warn('the PARI/GP function {function} is obsolete ({obsolete})', DeprecationWarning)\n"
+            parts.append("        from warnings import warn\n")
+            parts.append(f"        warn('the PARI/GP function {function} is obsolete ({obsolete})', DeprecationWarning)\n")
         # Warning for undocumented arguments
-        for a in args:
-            s += a.deprecation_warning_code(function)
-        for a in args:
-            s += a.convert_code()
-        s += "        sig_on()\n"
-        for a in args:
-            s += a.c_convert_code()
-        s += ret.assign_code("{cname}({callargs})")
-        s += ret.return_code()
-
-        s = s.format(function=function, protoargs=protoargs, cname=cname, callargs=callargs, doc=doc, obsolete=obsolete)
-        print(s, file=file)
-
-    def __call__(self):
+        parts.extend(a.deprecation_warning_code(function) for a in args)
+        parts.extend(a.convert_code() for a in args)
+        parts.append("        sig_on()\n")
+        parts.extend(a.c_convert_code() for a in args)
+        parts.append(ret.assign_code(f"{cname}({callargs})"))
+        parts.append(ret.return_code())
+        parts.append("\n")
+
+        file.write("".join(parts))
+
+    def output_filenames(self):
+        """
+        Return the list of files written by this generator.
+        """
+        return [self.gen_filename, self.instance_filename, self.decl_filename]
+
+    def restore_from_cache(self, cache):
+        """
+        Copy previously generated files from the directory ``cache``.
+
+        Return ``True`` if this succeeded, ``False`` if the files are
+        not in the cache or cannot be read. In the latter case, no
+        output file is changed.
+        """
+        if not os.path.isdir(cache):
+            return False
+        try:
+            for filename in self.output_filenames():
+                shutil.copyfile(os.path.join(cache, os.path.basename(filename)),
+                                filename + '.tmp')
+        except OSError:
+            # Damaged cache entry: treat it as a cache miss
+            for filename in self.output_filenames():
+                try:
+                    os.remove(filename + '.tmp')
+                except OSError:
+                    pass
+            return False
+        for filename in self.output_filenames():
+            os.rename(filename + '.tmp', filename)
+        return True
+
+    def store_in_cache(self, cache):
+        """
+        Copy the generated files to the directory ``cache``.
+
+        This replaces an existing entry ``cache`` and removes all other
+        entries, such that only the newest one is kept. Caching is an
+        optimization only: errors are ignored.
+        """
+        # Fill a temporary directory first, such that an interrupted
+        # build cannot leave an incomplete cache behind.
+        tmp = cache + '.tmp'
+        try:
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+            for filename in self.output_filenames():
+                shutil.copyfile(filename, os.path.join(tmp, os.path.basename(filename)))
+            shutil.rmtree(cache, ignore_errors=True)
+            os.rename(tmp, cache)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        # Remove older entries
+        for entry in os.listdir(self.cache_dirname):
+            path = os.path.join(self.cache_dirname, entry)
+            if path != cache:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def __call__(self, use_cache=True):
         """
         Top-level function to generate the auto-generated files.
+
+        If ``use_cache`` is ``True`` and the files were generated
+        before from the same ``pari.desc`` and the same ``autogen``
+        sources, they are copied from the cache in ``.cache/autogen``
+        instead. In any case, newly generated files are stored in the
+        cache.
         """
+        cache = os.path.join(self.cache_dirname, source_hash())
+        if use_cache and self.restore_from_cache(cache):
+            sys.stdout.write("Using cached PARI functions from %s\n" % cache)
+            return
+
         D = read_pari_desc()
-        D = sorted(D.values(), key=lambda d: d['function'])
+        D = sorted(D.values(), key=itemgetter('function'))
         sys.stdout.write("Generating PARI functions:")
 
-        self.gen_file = io.open(self.gen_filename + '.tmp', 'w', encoding='utf-8')
+        # Generate everything in memory, the files are written at once
+        # in the end.
+        self.gen_file = io.StringIO()
         self.gen_file.write(gen_banner)
-        self.instance_file = io.open(self.instance_filename + '.tmp', 'w', encoding='utf-8')
+        self.instance_file = io.StringIO()
         self.instance_file.write(instance_banner)
-        self.decl_file = io.open(self.decl_filename + '.tmp', 'w', encoding='utf-8')
+        self.decl_file = io.StringIO()
         self.decl_file.write(decl_banner)
 
         # Check for availability of hi-res SVG plotting. This requires
         # PARI-2.10 or later.
         have_plot_svg = False
 
-        for v in D:
-            func = v["function"]
-            if self.can_handle_function(**v):
-                sys.stdout.write(" %s" % func)
-                sys.stdout.flush()
-                self.handle_pari_function(**v)
-                if func == "plothraw":
-                    have_plot_svg = True
-            else:
-                sys.stdout.write(" (%s)" % func)
-        sys.stdout.write("\n")
+        # Most of the time is spent waiting for gphelp to produce the
+        # documentation, so generate the code in parallel threads.
+        # The results are collected in the order of D.
+        # Progress is written in batches and only flushed on a
+        # terminal, to keep the number of writes down on build logs.
+        progress = []
+        isatty = sys.stdout.isatty()
+        try:
+            with ThreadPoolExecutor() as executor:
+                futures = [executor.submit(self.generate_code, v) for v in D]
+                try:
+                    for v, future in zip(D, futures):
+                        code = future.result()
+                        func = v["function"]
+                        if len(progress) >= 50:
+                            sys.stdout.write(" " + " ".join(progress))
+                            if isatty:
+                                sys.stdout.flush()
+                            progress.clear()
+                        if code is None:
+                            progress.append("(%s)" % func)
+                            continue
+                        progress.append(func)
+                        gen, instance, decl = code
+                        self.gen_file.write(gen)
+                        self.instance_file.write(instance)
+                        self.decl_file.write(decl)
+                        if func == "plothraw":
+                            have_plot_svg = True
+                except BaseException:
+                    # Do not wait for the functions which are still
+                    # queued before reporting the error
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            # Also on errors, such that the output shows how far the
+            # generation got
+            sys.stdout.write(" " + " ".join(progress) + "\n")
+            sys.stdout.flush()
 
         self.instance_file.write("DEF HAVE_PLOT_SVG = {}".format(have_plot_svg))
 
-        self.gen_file.close()
-        self.instance_file.close()
-        self.decl_file.close()
+        # The files are independent, so write them in parallel
+        outputs = [(self.gen_filename, self.gen_file),
+                   (self.instance_filename, self.instance_file),
+                   (self.decl_filename, self.decl_file)]
+        with ThreadPoolExecutor(len(outputs)) as executor:
+            list(executor.map(lambda out: write_tmp_file(*out), outputs))
 
         # All done? Let's commit.
-        os.rename(self.gen_filename + '.tmp', self.gen_filename)
-        os.rename(self.instance_filename + '.tmp', self.instance_filename)
-        os.rename(self.decl_filename + '.tmp', self.decl_filename)
+        for filename in self.output_filenames():
+            os.rename(filename + '.tmp', filename)
+
+        self.store_in_cache(cache)
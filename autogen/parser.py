@@ -14,12 +14,16 @@ Read and parse the file pari.desc
 
 from __future__ import absolute_import, unicode_literals
 
-import os, re, io
+import os, re, io, sys
+from functools import lru_cache
 
 from .args import pari_arg_types
 from .ret import pari_ret_types
 from .paths import pari_share
 
+# Prototype codes which are known but not supported
+unsupported_codes = frozenset(c for c, t in pari_arg_types.items() if t is None)
+
 paren_re = re.compile(r"[(](.*)[)]")
 argname_re = re.compile(r"[ {]*&?([A-Za-z_][A-Za-z0-9_]*)")
 
@@ -69,11 +73,124 @@ def read_pari_desc():
             key = key.lower().replace("-", "")
             fun[key] = value.strip()
 
+        # These short strings are compared often and repeated a lot
+        # across functions
+        for key in ("function", "cname", "class", "section"):
+            if key in fun:
+                fun[key] = sys.intern(fun[key])
+
         name = fun["function"]
         functions[name] = fun
 
     return functions
 
+@lru_cache(maxsize=4096)
+def split_prototype(proto):
+    """
+    Split a PARI prototype in its return type code and argument codes.
+
+    Many PARI functions share the same prototype, so the result is
+    cached.
+
+    INPUT:
+
+    - ``proto`` -- a PARI prototype like ``"GD0,L,DGDGDG"``
+
+    OUTPUT: a tuple ``(ret, codes)`` where
+
+    - ``ret`` is the prototype character for the return type (or the
+      empty string if the prototype does not specify one).
+
+    - ``codes`` is a tuple of pairs ``(c, default)`` where ``c`` is
+      the prototype character of an argument and ``default`` its
+      default value as given in the prototype (``None`` if the
+      argument has no ``D`` prefix). If the prototype ends in the
+      middle of a default value, the last pair is ``("", None)``.
+
+    EXAMPLES::
+
+        >>> from autogen.parser import split_prototype
+        >>> split_prototype('GD0,L,DGDGDG')
+        ('', (('G', None), ('L', '0'), ('G', ''), ('G', ''), ('G', '')))
+        >>> split_prototype('lp')
+        ('l', (('p', None),))
+        >>> split_prototype('')
+        ('', ())
+
+    TESTS::
+
+        >>> split_prototype('&VrDlVb')
+        ('', (('&', None), ('V', None)))
+        >>> split_prototype('GDl')
+        ('', (('G', None), ('', None)))
+    """
+    # First, handle the return type
+    if proto and proto[0] in pari_ret_types:
+        ret = proto[0]
+        n = 1  # index in proto
+    else:
+        ret = ""
+        n = 0  # index in proto
+
+    # Go over the prototype characters and split off default values.
+    # Stop at the first unknown or unsupported code: parse_prototype()
+    # raises an error for it anyway, the rest should not be looked at.
+    codes = []
+    try:
+        while n < len(proto):
+            c = proto[n]; n += 1
+
+            # Parse default value
+            if c == "D":
+                default = ""
+                if proto[n] not in pari_arg_types:
+                    while True:
+                        c = proto[n]; n += 1
+                        if c == ",":
+                            break
+                        default += c
+                c = proto[n]; n += 1
+            else:
+                default = None
+
+            if c == ",":
+                continue  # Just skip additional commas
+            codes.append((c, default))
+            if pari_arg_types.get(c) is None:
+                break
+    except IndexError:
+        # Let parse_prototype() raise an error when it gets here
+        codes.append(("", None))
+
+    return (ret, tuple(codes))
+
+def supported_prototype(proto):
+    """
+    Return whether all argument codes in the PARI prototype ``proto``
+    are supported.
+
+    This is a cheap check to avoid calling :func:`parse_prototype`
+    for functions which cannot be handled anyway. It does not detect
+    every problem: :func:`parse_prototype` may still raise
+    ``NotImplementedError``.
+
+    Only codes which are known but not supported make this return
+    ``False``. Anything else, like unknown codes, is left to
+    :func:`parse_prototype` to report.
+
+    EXAMPLES::
+
+        >>> from autogen.parser import supported_prototype
+        >>> supported_prototype('GD0,L,DGp')
+        True
+        >>> supported_prototype('V=GGEDG')
+        False
+        >>> supported_prototype('D"x",s,')
+        True
+    """
+    ret, codes = split_prototype(proto)
+    return not any(c in unsupported_codes for c, default in codes)
+
 def parse_prototype(proto, help, initial_args=[]):
     """
     Parse arguments and return type of a PARI function.
@@ -110,6 +227,17 @@ def parse_prototype(proto, help, initial_args=[]):
         ([GEN x, GEN* r=NULL], GEN)
         >>> parse_prototype("lp", "foo()", [str("TEST")])
         (['TEST', prec precision=0], long)
+
+    TESTS::
+
+        >>> parse_prototype("GDl", "foo(x)")
+        Traceback (most recent call last):
+        ...
+        ValueError: incomplete prototype 'GDl'
+        >>> parse_prototype("GDGLD5", "foo(x,y,n,z)")
+        Traceback (most recent call last):
+        ...
+        NotImplementedError: non-default argument after default argument is only implemented for GEN arguments
     """
     # Use the help string just for the argument names.
     # "names" should be an iterator over the argument names.
@@ -122,43 +250,21 @@ def parse_prototype(proto, help, initial_args=[]):
         names = (m.groups()[0] for m in matches if m is not None)
 
     # First, handle the return type
-    try:
-        c = proto[0]
-        t = pari_ret_types[c]
-        n = 1  # index in proto
-    except (IndexError, KeyError):
-        t = pari_ret_types[""]
-        n = 0  # index in proto
-    ret = t()
+    c, codes = split_prototype(proto)
+    ret = pari_ret_types[c]()
 
-    # Go over the prototype characters and build up the arguments
+    # Go over the argument codes and build up the arguments
     args = list(initial_args)
     have_default = False  # Have we seen any default argument?
-    while n < len(proto):
-        c = proto[n]; n += 1
-
-        # Parse default value
-        if c == "D":
-            default = ""
-            if proto[n] not in pari_arg_types:
-                while True:
-                    c = proto[n]; n += 1
-                    if c == ",":
-                        break
-                    default += c
-            c = proto[n]; n += 1
-        else:
-            default = None
-
+    for c, default in codes:
+        if not c:
+            raise ValueError('incomplete prototype %r' % proto)
         try:
             t = pari_arg_types[c]
             if t is None:
                 raise NotImplementedError('unsupported prototype character %r' % c)
         except KeyError:
-            if c == ",":
-                continue  # Just skip additional commas
-            else:
-                raise ValueError('unknown prototype character %r' % c)
+            raise ValueError('unknown prototype character %r' % c)
 
         arg = t(names, default, index=len(args))
         if arg.default is not None: